@@ -2,25 +2,56 @@ import json
 import os
 import re
 import time
+from urllib.parse import urljoin
 
-import openpyxl
+import lxml.html
+import numpy as np
+import pandas as pd
+import requests
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
 
 # ─── Configuration ────────────────────────────────────────────────────────────
 
 load_dotenv()
 
-ACTION_DELAY = float(os.getenv("ACTION_DELAY", "1.0"))
+# Pause optionnelle (en secondes) après chaque clic / envoi de formulaire, pour ménager le site.
+# Les attentes explicites suffisent à synchroniser le script : 0 par défaut.
+CLICK_DELAY = float(os.getenv("CLICK_DELAY", "0"))
+# Pause entre deux tentatives de navigation ratées (ACTION_DELAY accepté pour compatibilité)
+NAV_DELAY = float(os.getenv("NAV_DELAY", os.getenv("ACTION_DELAY", "0.5")))
 PAGE_TIMEOUT = int(os.getenv("PAGE_TIMEOUT", "30"))
+POLL_FREQUENCY = float(os.getenv("POLL_FREQUENCY", "0.1"))
+# Quand la session sauvegardée est encore valide, navigateur sans interface et sans
+# images/CSS/polices (HEADLESS=0 pour le voir). Sinon il s'ouvre visible pour la connexion manuelle.
+HEADLESS = os.getenv("HEADLESS", "1") == "1"
+# Expérimental : après la connexion, enchaîner les formulaires en HTTP direct (sans navigateur)
+HTTP_MODE = os.getenv("HTTP_MODE", "0") == "1"
+
+# Requêtes bloquées par le navigateur (motifs CDP séparés par des virgules) : traceurs et polices
+BLOCKED_URLS = [
+    url.strip()
+    for url in os.getenv(
+        "BLOCKED_URLS", "*googletagmanager*,*google-analytics*,*hotjar*,*.woff2"
+    ).split(",")
+    if url.strip()
+]
 
 EXCEL_PATH = os.path.join(os.path.dirname(__file__), "TVA A TRANSFERER.xlsx")
 PROGRESS_DIR = os.path.dirname(__file__)
+# Cookies de la dernière session authentifiée, réutilisés pour éviter la connexion manuelle
+COOKIES_FILE = os.path.join(PROGRESS_DIR, ".session_cookies.json")
+# Tentatives par SIREN avant de le noter en erreur (pauses de 1 s, 2 s, 4 s... entre deux)
+SIREN_ATTEMPTS = max(1, int(os.getenv("SIREN_ATTEMPTS", "3")))
+# Chemin de chromedriver résolu par Selenium Manager, réutilisé pendant DRIVER_CACHE_TTL secondes
+DRIVER_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "autotva", "driver.json")
+DRIVER_CACHE_TTL = 7 * 24 * 3600
+# Le journal de progression n'est écrit sur disque que toutes les N lignes (et sur erreur)
+PROGRESS_FLUSH_EVERY = int(os.getenv("PROGRESS_FLUSH_EVERY", "10"))
 
 SHEETS_TO_PROCESS = ["TVA 3", "TVA 4", "TVA 5 ", "TVA 6 ", "TVA 7", "TVA 8"]
 
@@ -35,37 +66,127 @@ SERVICES = [
     {"label": "Consulter le Compte fiscal", "check_all": True},
     {"label": "Déclarer le Résultat",      "check_all": False},
 ]
+# Même liste en tuples (label, check_all), pour la boucle de traitement.
+# is_last n'est pas précalculé : il dépend des services proposés pour chaque SIREN.
+SERVICES_TUP = tuple((service["label"], service["check_all"]) for service in SERVICES)
 
 
 # ─── Utilitaires ──────────────────────────────────────────────────────────────
 
+_ABONNE_RE = re.compile(r"\d+")
+# Poids de la clé de Luhn d'un SIREN : un chiffre sur deux doublé, en partant de la droite
+_LUHN_WEIGHTS = np.array([1, 2, 1, 2, 1, 2, 1, 2, 1], dtype=np.int8)
+# Motif noté dans le fichier d'erreurs pour un SIREN écarté par le contrôle de Luhn
+_LUHN_ERROR = "cle de Luhn invalide"
+
+
 def progress_file_for(sheet_name):
-    """Retourne le chemin du fichier de progression pour un onglet."""
+    """Retourne le chemin du journal des SIRENs traités pour un onglet."""
+    safe_name = sheet_name.strip().replace(" ", "_")
+    return os.path.join(PROGRESS_DIR, f"progress_{safe_name}.done")
+
+
+def _read_log_lines(path):
+    """Lit les numéros d'un journal, en ignorant une dernière ligne sans retour à la ligne."""
+    with open(path, "r") as f:
+        return [int(line) for line in f if line.endswith("\n") and line.strip().isdigit()]
+
+
+def legacy_progress_file(sheet_name):
+    """
+    Retourne le chemin du fichier de progression des versions précédentes
+    pour un onglet : progress_<onglet>.json, {"siren_index": n} avec les
+    SIRENs 0 à n-1 traités.
+    """
     safe_name = sheet_name.strip().replace(" ", "_")
     return os.path.join(PROGRESS_DIR, f"progress_{safe_name}.json")
 
 
-def load_progress(sheet_name):
-    """Charge la progression depuis le fichier JSON pour un onglet."""
-    pf = progress_file_for(sheet_name)
-    if os.path.exists(pf):
-        with open(pf, "r") as f:
-            return json.load(f)
-    return {"siren_index": 0}
+def load_legacy_progress(sheet_name, rows):
+    """
+    Retourne les lignes Excel marquées traitées par le fichier JSON des
+    versions précédentes : celles des `siren_index` premiers SIRENs de `rows`.
+    """
+    legacy = legacy_progress_file(sheet_name)
+    if not os.path.exists(legacy):
+        return set()
+    try:
+        with open(legacy, "r") as f:
+            return set(rows[:int(json.load(f).get("siren_index", 0))])
+    except (OSError, ValueError, AttributeError):
+        print(f"  Fichier de progression illisible ignore: {os.path.basename(legacy)}")
+        return set()
 
 
-def save_progress(sheet_name, siren_index):
-    """Sauvegarde la progression actuelle pour un onglet."""
+def load_progress(sheet_name, legacy_rows):
+    """
+    Charge la progression d'un onglet : l'ensemble des lignes Excel des SIRENs
+    déjà traités. Une ligne Excel ne bouge pas quand un SIREN est ajouté,
+    corrigé ou écarté, contrairement à une position dans la liste des SIRENs.
+    La progression du fichier JSON des versions précédentes est reprise en
+    convertissant ses positions avec `legacy_rows`, les lignes de tous les
+    SIRENs lus (y compris ceux écartés par le contrôle de Luhn, comme alors).
+    Une dernière ligne sans retour à la ligne (écriture interrompue) est ignorée.
+    """
     pf = progress_file_for(sheet_name)
-    with open(pf, "w") as f:
-        json.dump({"siren_index": siren_index}, f, indent=2)
+    done = set(_read_log_lines(pf)) if os.path.exists(pf) else set()
+    return done | load_legacy_progress(sheet_name, legacy_rows)
+
+
+class ProgressLog:
+    """
+    Journal des SIRENs traités d'un onglet, en ajout seul : une ligne par
+    SIREN terminé, avec le numéro de sa ligne dans l'Excel.
+    Le tampon n'est vidé sur disque que toutes les PROGRESS_FLUSH_EVERY lignes,
+    sur flush() et à la fermeture. À l'ouverture, le journal est compacté (un
+    numéro par ligne, sans doublon) par renommage atomique (os.replace), et la
+    progression du fichier JSON des versions précédentes y est reprise.
+    """
+
+    def __init__(self, sheet_name, legacy_rows):
+        path = progress_file_for(sheet_name)
+        self.done = load_progress(sheet_name, legacy_rows)
+        legacy = legacy_progress_file(sheet_name)
+        if os.path.exists(path) or os.path.exists(legacy):
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                f.writelines(f"{row}\n" for row in sorted(self.done))
+            os.replace(tmp, path)
+            # Ancien fichier supprimé seulement une fois son contenu repris
+            if os.path.exists(legacy):
+                os.remove(legacy)
+        self.file = open(path, "a")
+        self.pending = 0
+
+    def mark_done(self, row):
+        # Rien à écrire si la ligne est déjà notée
+        if row in self.done:
+            return
+        self.done.add(row)
+        self.file.write(f"{row}\n")
+        self.pending += 1
+        if self.pending >= PROGRESS_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def clear_progress(sheet_name):
-    """Supprime le fichier de progression pour un onglet."""
-    pf = progress_file_for(sheet_name)
-    if os.path.exists(pf):
-        os.remove(pf)
+    """Supprime le journal de progression pour un onglet (et celui des versions précédentes)."""
+    for pf in (progress_file_for(sheet_name), legacy_progress_file(sheet_name)):
+        if os.path.exists(pf):
+            os.remove(pf)
 
 
 def error_file_for(sheet_name):
@@ -74,104 +195,354 @@ def error_file_for(sheet_name):
     return os.path.join(PROGRESS_DIR, f"erreurs_{safe_name}.txt")
 
 
-def log_siren_error(sheet_name, siren, index, reason):
-    """Ajoute un SIREN en erreur dans le fichier d'erreurs de l'onglet."""
+def log_siren_error(sheet_name, siren, row, reason):
+    """Ajoute un SIREN en erreur (et sa ligne dans l'Excel) dans le fichier d'erreurs de l'onglet."""
     ef = error_file_for(sheet_name)
     with open(ef, "a") as f:
-        f.write(f"{siren} (index {index}) : {reason}\n")
+        f.write(f"{siren} (ligne {row}) : {reason}\n")
     print(f"   >> SIREN {siren} note dans {os.path.basename(ef)}")
 
 
+def log_rejected_sirens(sheet_name, rejected):
+    """
+    Note dans le fichier d'erreurs de l'onglet les SIRENs (ligne, SIREN) écartés
+    par le contrôle de Luhn, sauf ceux qu'une exécution précédente y a déjà notés.
+    """
+    ef = error_file_for(sheet_name)
+    logged = set()
+    if os.path.exists(ef):
+        with open(ef, "r") as f:
+            logged = {line.rstrip("\n") for line in f}
+    for row, siren in rejected:
+        if f"{siren} (ligne {row}) : {_LUHN_ERROR}" not in logged:
+            log_siren_error(sheet_name, siren, row, _LUHN_ERROR)
+
+
+def load_cookies():
+    """Charge les cookies de la dernière session, ou None s'il n'y en a pas."""
+    if not os.path.exists(COOKIES_FILE):
+        return None
+    try:
+        with open(COOKIES_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cookies(cookies):
+    """Sauvegarde les cookies d'une session authentifiée, lisibles par le seul utilisateur."""
+    fd = os.open(COOKIES_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # Le mode d'os.open ne s'applique qu'à la création : resserrer aussi un fichier existant
+    os.chmod(COOKIES_FILE, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(cookies, f)
+
+
+def load_driver_path():
+    """Retourne le chemin de chromedriver mémorisé s'il est encore valable, sinon None."""
+    try:
+        with open(DRIVER_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = cache.get("path")
+    if time.time() - cache.get("ts", 0) > DRIVER_CACHE_TTL or not path or not os.path.exists(path):
+        return None
+    return path
+
+
+def save_driver_path(driver):
+    """
+    Mémorise le chemin de chromedriver de ce navigateur. Après une mise à jour
+    de Chrome, la création de session échoue avec ce chemin et init_driver()
+    l'oublie : la version de Chrome n'a pas besoin d'être mémorisée.
+    """
+    cache = {
+        "path": driver.service.path,
+        "ts": time.time(),
+    }
+    try:
+        os.makedirs(os.path.dirname(DRIVER_CACHE_FILE), exist_ok=True)
+        with open(DRIVER_CACHE_FILE, "w") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+
+def clear_driver_path():
+    """Oublie le chemin de chromedriver mémorisé."""
+    if os.path.exists(DRIVER_CACHE_FILE):
+        os.remove(DRIVER_CACHE_FILE)
+
+
 def extract_abonne_number(cell_value):
     """Extrait le numéro d'abonné depuis 'ABONNE 20260410001818'."""
-    match = re.search(r"\d+", str(cell_value))
+    text = cell_value if isinstance(cell_value, str) else str(cell_value)
+    # Formats attendus '20260410001818' ou 'ABONNE 20260410001818' : pas besoin de regex
+    head, _, tail = text.strip().rpartition(" ")
+    if tail.isdecimal() and (not head or head.strip().isalpha()):
+        return tail
+    match = _ABONNE_RE.search(text)
     return match.group() if match else None
 
 
+def luhn_valid(sirens):
+    """
+    Retourne un tableau de booléens indiquant, pour chaque SIREN, s'il a bien
+    9 chiffres et une clé de Luhn valide. Le calcul est vectorisé sur toute
+    la liste (matrice N x 9).
+    """
+    well_formed = np.array([len(s) == 9 and s.isascii() and s.isdigit() for s in sirens], dtype=bool)
+    valid = np.zeros(len(sirens), dtype=bool)
+    candidates = [s for s, ok in zip(sirens, well_formed) if ok]
+    if candidates:
+        raw = np.frombuffer("".join(candidates).encode("ascii"), dtype=np.uint8)
+        digits = (raw - ord("0")).astype(np.int8).reshape(-1, 9)
+        products = digits * _LUHN_WEIGHTS
+        products = np.where(products >= 10, products - 9, products)
+        valid[well_formed] = products.sum(axis=1) % 10 == 0
+    return valid
+
+
+def read_siren_column(xls, sheet_name):
+    """
+    Retourne la colonne D d'un onglet à partir de la ligne 4, sans les cellules
+    vides. Un onglet sans ligne de données ou sans colonne D donne une série vide.
+    """
+    try:
+        frame = xls.parse(sheet_name=sheet_name, header=None, usecols=[3], skiprows=3)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError):
+        # usecols hors limites (pas de colonne D) ou onglet vide
+        frame = pd.DataFrame()
+    if frame.shape[1] == 0:
+        return pd.Series(dtype=object)
+    return frame.iloc[:, 0].dropna()
+
+
 def read_excel():
     """Lit le fichier Excel et retourne les données par onglet."""
-    wb = openpyxl.load_workbook(EXCEL_PATH, data_only=True)
+    # calamine (Rust) lit le classeur bien plus vite qu'openpyxl et sans modèle objet par cellule.
+    # Le classeur n'est ouvert qu'une fois, et refermé dès la lecture terminée.
+    with pd.ExcelFile(EXCEL_PATH, engine="calamine") as xls:
+        wb = xls.book
+        sheets = []
+        for sheet_name in SHEETS_TO_PROCESS:
+            if sheet_name in wb.sheet_names:
+                sheets.append(sheet_name)
+            else:
+                print(f"  Onglet '{sheet_name}' non trouve, ignore.")
+
+        columns = {name: read_siren_column(xls, name) for name in sheets}
+        first_rows = {
+            name: wb.get_sheet_by_name(name).to_python(skip_empty_area=False, nrows=1)
+            for name in sheets
+        }
+
     data = {}
-    for sheet_name in SHEETS_TO_PROCESS:
-        if sheet_name not in wb.sheetnames:
-            print(f"  Onglet '{sheet_name}' non trouve, ignore.")
-            continue
-        ws = wb[sheet_name]
-        abonne = extract_abonne_number(ws["A1"].value)
-        sirens = []
-        for row in ws.iter_rows(min_row=4, max_row=ws.max_row, min_col=4, max_col=4):
-            cell = row[0]
-            if cell.value is not None:
-                try:
-                    siren = str(int(float(str(cell.value)))).zfill(9)
-                    sirens.append(siren)
-                except (ValueError, TypeError):
-                    print(f"    Valeur invalide ignoree en {cell.coordinate}: {cell.value}")
-                    continue
-        data[sheet_name] = {"abonne": abonne, "sirens": sirens}
+    for sheet_name in sheets:
+        first_row = first_rows[sheet_name]
+        abonne = extract_abonne_number(first_row[0][0] if first_row and first_row[0] else None)
+
+        # Conversion vectorisée : les valeurs non numériques deviennent NaN
+        raw = columns[sheet_name]
+        numbers = pd.to_numeric(raw, errors="coerce")
+        for row_index, value in raw[numbers.isna()].items():
+            print(f"    Valeur invalide ignoree en D{row_index + 4}: {value}")
+        column = numbers.dropna().astype("int64").astype(str).str.zfill(9)
+        # Numéro de ligne Excel de chaque SIREN : clé stable de la progression
+        column.index = column.index + 4
+        # Lignes de tous les SIRENs lus, avant le filtre de Luhn : c'est la liste sur
+        # laquelle portent les positions du fichier de progression JSON des versions précédentes
+        read_rows = column.index.tolist()
+
+        # Écarter d'emblée les SIRENs mal saisis plutôt que de les découvrir sur le site
+        valid = luhn_valid(column.tolist())
+        rejected = column[~valid]
+        if not rejected.empty:
+            print(f"    {len(rejected)} SIREN(s) a cle invalide ignore(s): {', '.join(rejected)}")
+        column = column[valid]
+        data[sheet_name] = {
+            "abonne": abonne, "sirens": column.tolist(), "rows": column.index.tolist(), "read_rows": read_rows,
+            "rejected": list(rejected.items()),
+        }
         print(f"  {sheet_name}: abonne={abonne}, {len(sirens)} SIRENs")
     return data
 
 
 # ─── Selenium : actions sur le navigateur ─────────────────────────────────────
+# Chaque commande WebDriver est un aller-retour avec chromedriver : les lectures
+# et actions qui touchent plusieurs éléments de la page sont donc regroupées
+# dans un seul execute_script, exécuté dans la page.
+
+def pause(delay):
+    """Marque une pause de `delay` secondes si elle est configurée (CLICK_DELAY...)."""
+    if delay > 0:
+        time.sleep(delay)
+
+
+def wait_ready(driver, timeout=None):
+    """
+    Attend que le DOM du document courant soit prêt (readyState 'interactive'
+    ou 'complete'), cohérent avec la stratégie de chargement 'eager'.
+    """
+    timeout = timeout or PAGE_TIMEOUT
+    WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY).until(
+        lambda d: d.execute_script("return document.readyState !== 'loading'")
+    )
+
+
+def page_state(driver):
+    """
+    Décrit la page courante : présence du lien d'erreur 'Fermer' et du champ
+    SIREN, et URL courante. Remplace les find_element
+    utilisés comme tests (une exception à construire quand l'élément est absent).
+    """
+    return driver.execute_script("""
+        return {
+            hasFermer: Array.from(document.querySelectorAll('a'))
+                .some(a => a.textContent.includes('Fermer')),
+            hasSaisieSiren: !!document.querySelector('#saisieSiren'),
+            url: location.href,
+        };
+    """)
+
 
 def wait_and_find(driver, selector, by=By.CSS_SELECTOR, timeout=None):
     """Attend qu'un élément soit présent et le retourne."""
     timeout = timeout or PAGE_TIMEOUT
-    return WebDriverWait(driver, timeout).until(
+    return WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY).until(
         EC.presence_of_element_located((by, selector))
     )
 
 
-def wait_and_click(driver, selector, by=By.CSS_SELECTOR, timeout=None):
-    """Attend qu'un élément soit cliquable et clique dessus."""
+def wait_for_stale(driver, element, timeout=None):
+    """Attend que l'élément soit détaché du DOM, signe que la page a été remplacée."""
+    timeout = timeout or PAGE_TIMEOUT
+    WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY).until(
+        EC.staleness_of(element)
+    )
+
+
+def wait_and_click(driver, selector, by=By.CSS_SELECTOR, timeout=None, until=None):
+    """
+    Attend qu'un élément soit cliquable et clique dessus.
+    Si `until` est donné (condition expected_conditions), attend que la page
+    cliquée soit remplacée puis que la condition soit remplie sur la nouvelle.
+    Sinon, c'est à l'appelant d'attendre l'état suivant de la page.
+    """
     timeout = timeout or PAGE_TIMEOUT
-    element = WebDriverWait(driver, timeout).until(
+    element = WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY).until(
         EC.element_to_be_clickable((by, selector))
     )
     element.click()
-    time.sleep(ACTION_DELAY)
+    pause(CLICK_DELAY)
+    if until is not None:
+        wait_for_stale(driver, element, timeout)
+        WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY).until(until)
     return element
 
 
-def fill_input(driver, selector, value, by=By.CSS_SELECTOR):
-    """Remplit un champ input."""
-    element = wait_and_find(driver, selector, by)
-    element.clear()
-    element.send_keys(value)
-    time.sleep(ACTION_DELAY / 2)
-    return element
+# Début commun des scripts de saisie : affecte la valeur arguments[1] au champ
+# arguments[0] (au lieu de send_keys() qui simule chaque frappe) et émet les
+# événements 'input' et 'change' attendus par les scripts du site.
+_FILL_FIELD_JS = """
+    const field = document.querySelector(arguments[0]);
+    if (!field) return null;
+    field.value = arguments[1];
+    field.dispatchEvent(new Event('input', {bubbles: true}));
+    field.dispatchEvent(new Event('change', {bubbles: true}));
+"""
+
 
+def ensure_submitted(field, selector):
+    """Vérifie que le script de saisie a trouvé son champ, puis applique CLICK_DELAY."""
+    if field is None:
+        raise Exception(f"Champ '{selector}' introuvable")
+    pause(CLICK_DELAY)
 
-def init_driver():
-    """Initialise le navigateur Chrome."""
+
+def init_driver(headless=False):
+    """
+    Initialise le navigateur Chrome.
+    En mode headless, aucune fenêtre n'est affichée et les images, feuilles de
+    style et polices ne sont pas chargées : seuls les formulaires nous servent.
+    """
     options = webdriver.ChromeOptions()
-    options.add_argument("--start-maximized")
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.stylesheets": 2,
+            "profile.managed_default_content_settings.fonts": 2,
+            "profile.managed_default_content_settings.plugins": 2,
+            # Les cookies restent autorisés : la session en dépend
+            "profile.default_content_setting_values.cookies": 1,
+        })
+    else:
+        options.add_argument("--start-maximized")
+    # driver.get() rend la main dès DOMContentLoaded, les attentes explicites font le reste
+    options.page_load_strategy = "eager"
     options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_argument("--disable-extensions")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+    if os.getenv("CI"):
+        # Conteneurs d'intégration continue : le bac à sable de Chrome n'y est pas disponible
+        options.add_argument("--no-sandbox")
+    driver_path = load_driver_path()
+    driver = None
+    if driver_path:
+        # Chemin mémorisé : pas de résolution par Selenium Manager au démarrage
+        try:
+            driver = webdriver.Chrome(service=Service(driver_path), options=options)
+        except Exception:
+            # chromedriver absent ou incompatible (Chrome mis à jour) : on le fait résoudre à nouveau
+            clear_driver_path()
+    if driver is None:
+        # Sans chemin explicite, Selenium Manager (intégré à Selenium >= 4.11) résout
+        # chromedriver et le garde en cache par version de Chrome (~/.cache/selenium)
+        driver = webdriver.Chrome(service=Service(), options=options)
+        save_driver_path(driver)
+    block_urls(driver)
     return driver
 
 
+def block_urls(driver):
+    """
+    Bloque les requêtes BLOCKED_URLS dans la fenêtre courante : moins de
+    requêtes par page, l'événement de chargement arrive plus tôt.
+    Le blocage CDP ne vaut que pour cette fenêtre : à refaire après chaque
+    bascule vers une fenêtre nouvellement ouverte.
+    """
+    if BLOCKED_URLS:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+
+
 def navigate_to_delegation_page(driver, max_retries=3):
     """
-    Depuis la page d'accueil ou la page services, navigue jusqu'à la page SIREN.
-    Gère la page d'erreur "Fermer", les nouveaux onglets et la fenêtre popup.
+    Navigue jusqu'à la page SIREN, en l'ouvrant directement (DELEGATION_URL)
+    dans la fenêtre principale. Si le site ne l'accepte pas, repasse par
+    l'accueil, la page services et la fenêtre popup.
+    Gère la page d'erreur "Fermer" et les onglets ouverts en trop.
+    Retourne le handle de la fenêtre de saisie, mémorisé dans driver._popup_handle.
     """
     for attempt in range(max_retries):
         try:
             print(f"    Tentative {attempt + 1}/{max_retries}...")
-            print(f"    URL actuelle: {driver.current_url}")
+            state = page_state(driver)
+            print(f"    URL actuelle: {state['url']}")
 
             # Vérifier si on est sur une page d'erreur avec bouton "Fermer"
-            try:
-                fermer_link = driver.find_element(By.XPATH, "//a[contains(text(),'Fermer')]")
-                print("    Page d'erreur detectee, clic sur 'Fermer'...")
-                fermer_link.click()
-                time.sleep(ACTION_DELAY * 2)
-            except Exception:
-                pass
+            if state["hasFermer"]:
+                try:
+                    fermer_link = driver.find_element(By.XPATH, "//a[contains(text(),'Fermer')]")
+                    print("    Page d'erreur detectee, clic sur 'Fermer'...")
+                    fermer_link.click()
+                    wait_for_stale(driver, fermer_link)
+                except Exception:
+                    pass
 
             # Fermer toutes les fenêtres/onglets sauf le premier et y revenir
             main_handle = driver.window_handles[0]
@@ -179,26 +550,38 @@ def navigate_to_delegation_page(driver, max_retries=3):
                 driver.switch_to.window(handle)
                 driver.close()
             driver.switch_to.window(main_handle)
-            time.sleep(ACTION_DELAY)
+
+            # Chemin direct : l'URL de la page SIREN est connue, la session suffit
+            try:
+                driver.get(DELEGATION_URL)
+                wait_and_find(driver, "#saisieSiren", timeout=10)
+                print("  Page de saisie SIREN atteinte.")
+                driver._popup_handle = main_handle
+                return main_handle
+            except Exception:
+                print("    Acces direct refuse, passage par la page services...")
 
             # S'assurer qu'on est sur la page d'accueil
             if "accueil" not in driver.current_url:
                 driver.get(f"{BASE_URL}/mire/accueil.do")
-                time.sleep(ACTION_DELAY * 2)
+                wait_ready(driver)
 
             # Étape 1 : Cliquer sur "Gérer les services" (ouvre un nouvel onglet)
             print("    Clic sur 'Gerer les services'...")
             handles_before = set(driver.window_handles)
             wait_and_click(driver, "//a[contains(text(),'rer les services')]", by=By.XPATH, timeout=PAGE_TIMEOUT)
-            time.sleep(ACTION_DELAY * 3)
 
             # Attendre que le nouvel onglet/fenêtre apparaisse et y basculer
-            WebDriverWait(driver, PAGE_TIMEOUT).until(lambda d: len(d.window_handles) > len(handles_before))
+            WebDriverWait(driver, PAGE_TIMEOUT, poll_frequency=POLL_FREQUENCY).until(
+                lambda d: len(d.window_handles) > len(handles_before)
+            )
             new_handles = set(driver.window_handles) - handles_before
             services_handle = new_handles.pop()
             driver.switch_to.window(services_handle)
+            # Page déjà en cours de chargement : le blocage vaut pour les suivantes
+            block_urls(driver)
+            wait_ready(driver)
             print(f"    Page services, URL: {driver.current_url}")
-            time.sleep(ACTION_DELAY * 2)
 
             # Étape 2 : Ouvrir la page de délégation SIREN
             # Le lien utilise javascript:winPop() qui fait window.open()
@@ -208,45 +591,106 @@ def navigate_to_delegation_page(driver, max_retries=3):
             driver.execute_script(
                 "window.open('SaisieSirenDelegation.do?choixSirenIn=true','delegation','width=810,height=600');"
             )
-            time.sleep(ACTION_DELAY * 3)
 
             # Attendre que la fenêtre popup apparaisse et y basculer
-            WebDriverWait(driver, PAGE_TIMEOUT).until(lambda d: len(d.window_handles) > len(handles_before_popup))
+            WebDriverWait(driver, PAGE_TIMEOUT, poll_frequency=POLL_FREQUENCY).until(
+                lambda d: len(d.window_handles) > len(handles_before_popup)
+            )
             popup_handles = set(driver.window_handles) - handles_before_popup
             popup_handle = popup_handles.pop()
             driver.switch_to.window(popup_handle)
-            print(f"    Popup delegation, URL: {driver.current_url}")
-            time.sleep(ACTION_DELAY)
+            block_urls(driver)
+            wait_ready(driver)
+            state = page_state(driver)
+            print(f"    Popup delegation, URL: {state['url']}")
 
             # Vérifier si on a atterri sur la page d'erreur
-            try:
-                driver.find_element(By.XPATH, "//a[contains(text(),'Fermer')]")
+            if state["hasFermer"]:
                 print("    Page d'erreur dans le popup, on recommence...")
                 continue
-            except Exception:
-                pass
 
             # Vérifier qu'on est bien sur la page SIREN
-            wait_and_find(driver, "#saisieSiren", timeout=10)
+            if not state["hasSaisieSiren"]:
+                wait_and_find(driver, "#saisieSiren", timeout=10)
             print("  Page de saisie SIREN atteinte.")
-            return True
+            driver._popup_handle = popup_handle
+            return popup_handle
 
         except Exception as e:
             print(f"    Echec tentative {attempt + 1}: {e}")
-            time.sleep(ACTION_DELAY * 2)
+            # Seule pause fixe restante : laisser le site respirer avant de réessayer
+            pause(NAV_DELAY)
 
     raise Exception("Impossible d'atteindre la page de saisie SIREN apres plusieurs tentatives")
 
 
+def inject_cookies(driver, cookies):
+    """Ouvre le site et y dépose les cookies d'une session authentifiée."""
+    driver.get(BASE_URL)
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except Exception:
+            # Cookie d'un autre domaine que la page courante : ignoré
+            pass
+
+
+def restore_session(driver, cookies):
+    """
+    Réutilise la session sauvegardée lors d'une exécution précédente.
+    Retourne False si elle a expiré.
+    """
+    inject_cookies(driver, cookies)
+    driver.get(DELEGATION_URL)
+    try:
+        wait_and_find(driver, "#saisieSiren", timeout=5)
+    except Exception:
+        print("  Session precedente expiree.")
+        driver.delete_all_cookies()
+        return False
+    print("  Session precedente reutilisee, connexion manuelle inutile.")
+    driver._popup_handle = driver.current_window_handle
+    return True
+
+
 def login(driver):
     """
-    Attend que l'utilisateur se connecte manuellement sur impots.gouv.fr
-    puis navigue vers la page de délégation via les pages intermédiaires.
+    Attend que l'utilisateur se connecte manuellement sur impots.gouv.fr puis
+    navigue vers la page de délégation via les pages intermédiaires.
+    Les cookies de la session sont ensuite sauvegardés.
     """
     driver.get(BASE_URL)
     print("  Connectez-vous manuellement dans le navigateur.")
     input("  Appuyez sur Entree une fois connecte...")
     navigate_to_delegation_page(driver)
+    save_cookies(driver.get_cookies())
+
+
+def open_session():
+    """
+    Retourne un navigateur connecté. Si la session sauvegardée est encore
+    valide, il est lancé sans interface (HEADLESS) ; sinon un navigateur
+    visible est ouvert pour la connexion manuelle.
+    """
+    cookies = load_cookies()
+    driver = None
+    if cookies:
+        driver = init_driver(headless=HEADLESS)
+        if restore_session(driver, cookies):
+            return driver
+        if HEADLESS:
+            # Connexion manuelle impossible sans fenêtre
+            driver.quit()
+            driver = None
+
+    if driver is None:
+        driver = init_driver()
+    try:
+        login(driver)
+    except BaseException:
+        driver.quit()
+        raise
+    return driver
 
 
 # ─── Étapes de délégation ─────────────────────────────────────────────────────
@@ -254,45 +698,119 @@ def login(driver):
 def navigate_to_siren_page(driver):
     """S'assure qu'on est sur la page de saisie SIREN."""
     # Vérifier si on est déjà sur la bonne page
-    try:
-        driver.find_element(By.CSS_SELECTOR, "#saisieSiren")
-    except Exception:
+    if not page_state(driver)["hasSaisieSiren"]:
         driver.get(f"{BASE_URL}/opale_usager/SaisieSirenDelegation.do?choixSirenIn=true")
-        time.sleep(ACTION_DELAY)
         wait_and_find(driver, "#saisieSiren")
 
 
+def return_to_popup(driver):
+    """
+    Rebascule sur la fenêtre de délégation mémorisée et y recharge la page SIREN :
+    une seule navigation au lieu du parcours complet depuis l'accueil.
+    Retourne False si la fenêtre n'existe plus ou si la session est perdue.
+    """
+    handle = getattr(driver, "_popup_handle", None)
+    if handle is None:
+        return False
+    try:
+        driver.switch_to.window(handle)
+        driver.get(DELEGATION_URL)
+        wait_and_find(driver, "#saisieSiren", timeout=10)
+        return True
+    except Exception:
+        return False
+
+
+def recover_siren_page(driver):
+    """
+    Après une erreur, revient sur la page de saisie SIREN par le chemin le plus
+    court : page courante, fenêtre popup mémorisée, puis parcours complet.
+    Retourne False si aucun n'a abouti.
+    """
+    try:
+        navigate_to_siren_page(driver)
+        return True
+    except Exception:
+        print("   Impossible de revenir a la page SIREN, re-navigation...")
+    try:
+        if not return_to_popup(driver):
+            navigate_to_delegation_page(driver)
+        return True
+    except Exception:
+        return False
+
+
 def enter_siren(driver, siren):
     """Entre le SIREN et clique sur Rechercher."""
-    fill_input(driver, "#saisieSiren", siren)
     # Le bouton Rechercher est un lien javascript:submitform('saisie')
-    driver.execute_script("submitform('saisie');")
-    time.sleep(ACTION_DELAY * 2)
+    selector = "#saisieSiren"
+    field = driver.execute_script(_FILL_FIELD_JS + """
+        submitform('saisie');
+        return field;
+    """, selector, siren)
+    ensure_submitted(field, selector)
+    wait_for_stale(driver, field)
+    wait_and_find(driver, "input[name='num_adh']")
 
 
 def enter_abonne_and_validate(driver, abonne):
     """Entre le numéro d'abonné et clique sur Valider."""
-    fill_input(driver, "input[name='num_adh']", abonne)
-    wait_and_click(driver, "input[type='submit'][value='Valider']")
-    time.sleep(ACTION_DELAY)
-
-
-def find_service_link(driver, service_label):
+    # Clic déclenché en JS (garde les gestionnaires submit et la valeur du bouton),
+    # sans attendre que le bouton soit "cliquable" au sens de Selenium
+    selector = "input[name='num_adh']"
+    field = driver.execute_script(_FILL_FIELD_JS + """
+        document.querySelector("input[type='submit'][value='Valider']").click();
+        return field;
+    """, selector, abonne)
+    ensure_submitted(field, selector)
+    wait_for_stale(driver, field)
+    wait_ready(driver)
+
+
+def click_service_link(driver, service_label):
+    """
+    Clique sur le lien 'Déléguer ou modifier' correspondant à un service donné :
+    celui de la ligne du tableau dont un label porte le nom du service.
+    Retourne le lien cliqué, ou None si le service n'est pas proposé.
+    """
+    return driver.execute_script("""
+        for (const row of document.querySelectorAll('tr.toutblenc')) {
+            const link = row.querySelector('a.formLabel');
+            const labels = Array.from(row.querySelectorAll('label'))
+                .map(l => l.textContent.replace(/\\s+/g, ' ').trim());
+            if (link && labels.includes(arguments[0])) {
+                link.click();
+                return link;
+            }
+        }
+        return null;
+    """, service_label)
+
+
+def build_service_href_map(driver):
     """
-    Trouve le lien 'Déléguer ou modifier' correspondant à un service donné.
-    On cherche la ligne du tableau qui contient le label du service,
-    puis on clique sur le lien 'Déléguer ou modifier' dans la même ligne.
+    Lit tout le tableau des services (même lecture des labels que
+    click_service_link) et retourne
+    {label: href du lien 'Déléguer ou modifier'} pour chaque ligne qui en a un.
+    L'href vaut None quand le lien passe par du JavaScript (href '#' ou
+    'javascript:', onclick) : il faut alors cliquer dessus.
     """
-    # Trouver toutes les lignes du tableau des services
-    rows = driver.find_elements(By.CSS_SELECTOR, "tr.toutblenc")
-    for row in rows:
-        labels = row.find_elements(By.CSS_SELECTOR, "label")
-        for label in labels:
-            if label.text.strip() == service_label:
-                # Trouvé ! Cliquer sur le lien "Déléguer ou modifier" de cette ligne
-                link = row.find_element(By.CSS_SELECTOR, "a.formLabel")
-                return link
-    return None
+    return driver.execute_script("""
+        const m = {};
+        for (const row of document.querySelectorAll('tr.toutblenc')) {
+            const link = row.querySelector('a.formLabel');
+            if (!link) {
+                continue;
+            }
+            const raw = (link.getAttribute('href') || '').trim().toLowerCase();
+            const direct = raw !== '' && !raw.startsWith('#') && !raw.startsWith('javascript:')
+                && !link.hasAttribute('onclick');
+            for (const label of row.querySelectorAll('label')) {
+                m[label.textContent.replace(/\\s+/g, ' ').trim()] = direct ? link.href : null;
+            }
+        }
+        return m;
+    """)
 
 
 def select_acteur(driver):
@@ -300,15 +818,18 @@ def select_acteur(driver):
     Le name peut être 'role', 'role0', 'role1', etc.
     Il peut y avoir plusieurs activités, chacune avec son propre radio."""
     try:
-        radios = driver.find_elements(By.CSS_SELECTOR, "input[type='radio'][value='N2']")
-        count = 0
-        for radio in radios:
-            name = radio.get_attribute("name") or ""
-            if name.startswith("role"):
-                if not radio.is_selected():
-                    radio.click()
-                    time.sleep(ACTION_DELAY / 2)
-                count += 1
+        count = driver.execute_script("""
+            let count = 0;
+            for (const r of document.querySelectorAll("input[type='radio'][value='N2']")) {
+                if ((r.name || '').startsWith('role')) {
+                    if (!r.checked) {
+                        r.click();
+                    }
+                    count++;
+                }
+            }
+            return count;
+        """)
         if count > 0:
             print(f"        Role 'Acteur' selectionne ({count} activite(s)).")
         else:
@@ -318,45 +839,67 @@ def select_acteur(driver):
 
 
 def check_all_checkboxes(driver):
-    """Coche toutes les checkboxes sur la page (pour Consulter le Compte fiscal)."""
-    checkboxes = driver.find_elements(By.CSS_SELECTOR, "input[type='checkbox']")
-    for cb in checkboxes:
-        if not cb.is_selected():
-            cb.click()
-            time.sleep(0.1)
-    time.sleep(ACTION_DELAY / 2)
+    """
+    Coche toutes les checkboxes sur la page (pour Consulter le Compte fiscal).
+    .click() plutôt que .checked = true, pour déclencher les gestionnaires
+    onclick du site.
+    """
+    driver.execute_script("""
+        for (const cb of document.querySelectorAll("input[type='checkbox']")) {
+            // État relu à chaque case : une case "tout cocher" a pu cocher les suivantes
+            if (!cb.checked) {
+                cb.click();
+            }
+        }
+    """)
+    # Une seule attente pour laisser le formulaire se stabiliser, au lieu d'une pause par case
+    WebDriverWait(driver, PAGE_TIMEOUT, poll_frequency=POLL_FREQUENCY).until(EC.any_of(
+        EC.element_to_be_clickable((By.CSS_SELECTOR, "input[type='submit'][value='Valider']")),
+        EC.element_to_be_clickable((By.XPATH, "//input[@value='Valider']")),
+    ))
 
 
 def click_valider(driver):
     """Clique sur le bouton Valider (plusieurs sélecteurs possibles)."""
-    try:
-        btn = driver.find_element(By.CSS_SELECTOR, "input[type='submit'][value='Valider']")
-        btn.click()
-    except Exception:
-        # Fallback : chercher par XPath tout bouton/input contenant 'Valider'
-        btn = driver.find_element(By.XPATH, "//input[@value='Valider']")
-        btn.click()
-    time.sleep(ACTION_DELAY)
+    # Sélecteur principal puis fallback (tout input de valeur 'Valider')
+    btn = driver.execute_script("""
+        const btn = document.querySelector("input[type='submit'][value='Valider']")
+            || document.querySelector("input[value='Valider']");
+        if (btn) {
+            btn.click();
+        }
+        return btn;
+    """)
+    if btn is None:
+        raise Exception("Bouton 'Valider' introuvable")
+    pause(CLICK_DELAY)
+    wait_for_stale(driver, btn)
+    wait_ready(driver)
 
 
 def click_nouvelle_delegation(driver):
     """Clique sur le lien 'Nouvelle délégation'."""
-    wait_and_click(driver, "a.lienBlanc[href*='GererDelegation.do']")
-    time.sleep(ACTION_DELAY)
+    wait_and_click(
+        driver, "a.lienBlanc[href*='GererDelegation.do']",
+        until=EC.presence_of_element_located((By.CSS_SELECTOR, "input[name='num_adh']")),
+    )
 
 
 def click_nouveau_siren(driver):
     """Clique sur le lien 'Nouveau SIREN'."""
-    wait_and_click(driver, "a.lienBlanc[href*='SaisieSirenDelegation.do']")
-    time.sleep(ACTION_DELAY)
+    wait_and_click(
+        driver, "a.lienBlanc[href*='SaisieSirenDelegation.do']",
+        until=EC.presence_of_element_located((By.CSS_SELECTOR, "#saisieSiren")),
+    )
 
 
-def process_delegation(driver, abonne, service, is_last=False):
+def process_delegation(driver, abonne, service_label, check_all, is_last=False, href=None):
     """
     Effectue une délégation complète pour un service donné.
 
     Flux :
-      1. Sur la page des services, cliquer sur "Déléguer ou modifier" du service
+      1. Sur la page des services, ouvrir "Déléguer ou modifier" du service
+         (directement via `href` s'il est connu, sinon en cliquant le lien)
       2. Sélectionner "Acteur" (radio N2)
       3. Si check_all, cocher toutes les checkboxes
       4. Valider
@@ -364,18 +907,19 @@ def process_delegation(driver, abonne, service, is_last=False):
          - Si is_last : cliquer "Nouveau SIREN"
          - Sinon : cliquer "Nouvelle délégation", puis entrer le n° abonné
     """
-    service_label = service["label"]
-    check_all = service["check_all"]
     print(f"      -> {service_label}...")
 
-    # 1. Cliquer sur "Déléguer ou modifier" pour ce service
-    link = find_service_link(driver, service_label)
-    if link is None:
-        print(f"         Service '{service_label}' non disponible, ignore.")
-        return False
-
-    link.click()
-    time.sleep(ACTION_DELAY * 2)
+    # 1. Ouvrir "Déléguer ou modifier" pour ce service
+    if href:
+        driver.get(href)
+    else:
+        link = click_service_link(driver, service_label)
+        if link is None:
+            print(f"         Service '{service_label}' non disponible, ignore.")
+            return False
+        pause(CLICK_DELAY)
+        wait_for_stale(driver, link)
+    wait_ready(driver)
 
     # 2. Sélectionner "Acteur"
     select_acteur(driver)
@@ -409,11 +953,8 @@ def process_siren(driver, siren, abonne):
     enter_abonne_and_validate(driver, abonne)
 
     # Détecter les services disponibles sur la page
-    available = []
-    for service in SERVICES:
-        link = find_service_link(driver, service["label"])
-        if link is not None:
-            available.append(service)
+    href_map = build_service_href_map(driver)
+    available = [(label, check_all) for label, check_all in SERVICES_TUP if label in href_map]
 
     if not available:
         print(f"   Aucun service disponible pour SIREN {siren}, passage au suivant.")
@@ -423,13 +964,234 @@ def process_siren(driver, siren, abonne):
     print(f"   {len(available)}/{len(SERVICES)} services disponibles")
 
     # Effectuer les délégations pour les services disponibles
-    for i, service in enumerate(available):
+    for i, (label, check_all) in enumerate(available):
         is_last = (i == len(available) - 1)
-        process_delegation(driver, abonne, service, is_last=is_last)
+        if i > 0:
+            # Page des services rechargée après chaque délégation : relire les liens
+            href_map = build_service_href_map(driver)
+        process_delegation(driver, abonne, label, check_all, is_last, href_map.get(label))
 
     print(f"   SIREN {siren} termine.")
 
 
+# ─── Mode HTTP (HTTP_MODE=1) ──────────────────────────────────────────────────
+# Même parcours que ci-dessus, mais en soumettant directement les formulaires
+# HTML avec la session du navigateur : ni rendu de page ni aller-retour
+# chromedriver. Selenium ne sert plus qu'à la connexion manuelle.
+
+def http_session_from_driver(driver):
+    """Crée une session requests avec les cookies et l'User-Agent du navigateur connecté."""
+    session = requests.Session()
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie["name"], cookie["value"],
+            domain=cookie.get("domain"), path=cookie.get("path", "/"),
+        )
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent")
+    return session
+
+
+def http_page(response):
+    """Vérifie une réponse et retourne le document HTML parsé (base_url = URL finale)."""
+    response.raise_for_status()
+    doc = lxml.html.fromstring(response.content, base_url=response.url)
+    if doc.xpath("//a[contains(text(),'Fermer')]"):
+        raise Exception(f"Page d'erreur du site ({response.url})")
+    return doc
+
+
+def http_find(doc, xpath):
+    """Retourne le premier élément correspondant à `xpath`, ou lève une exception."""
+    found = doc.xpath(xpath)
+    if not found:
+        raise Exception(f"Element introuvable ({xpath}) sur {doc.base_url}")
+    return found[0]
+
+
+def http_submit(session, doc, element, overrides, submit_value=None):
+    """
+    Soumet le formulaire contenant `element` comme le ferait le navigateur :
+    valeurs courantes du formulaire, remplacées par `overrides` (liste de
+    paires nom/valeur), plus le bouton de soumission `submit_value` s'il a un nom.
+    """
+    form = element if element.tag == "form" else http_find(element, "ancestor::form[1]")
+    names = {name for name, _ in overrides}
+    data = [(name, value) for name, value in form.form_values() if name not in names]
+    data += list(overrides)
+    if submit_value:
+        for button in form.xpath(".//input[@type='submit'][@value=$v]", v=submit_value):
+            if button.get("name"):
+                data.append((button.get("name"), submit_value))
+            break
+    url = form.action or doc.base_url
+    headers = {"Referer": doc.base_url}
+    if form.method == "POST":
+        return http_page(session.post(url, data=data, headers=headers, timeout=PAGE_TIMEOUT))
+    return http_page(session.get(url, params=data, headers=headers, timeout=PAGE_TIMEOUT))
+
+
+def http_follow(session, doc, href_part):
+    """Suit le lien 'lienBlanc' dont l'href contient `href_part` (Nouveau SIREN...)."""
+    link = http_find(doc, f"//a[contains(@class,'lienBlanc')][contains(@href,'{href_part}')]")
+    url = urljoin(doc.base_url, link.get("href"))
+    return http_page(session.get(url, headers={"Referer": doc.base_url}, timeout=PAGE_TIMEOUT))
+
+
+def http_enter_abonne(session, doc, abonne):
+    """Soumet le numéro d'abonné ; retourne la page des services."""
+    field = http_find(doc, "//input[@name='num_adh']")
+    return http_submit(session, doc, field, [("num_adh", abonne)], submit_value="Valider")
+
+
+def http_service_links(doc):
+    """Équivalent de build_service_href_map() : {label: URL absolue ou None}."""
+    links = {}
+    for row in doc.xpath("//tr[contains(concat(' ', normalize-space(@class), ' '), ' toutblenc ')]"):
+        anchors = row.xpath(".//a[contains(concat(' ', normalize-space(@class), ' '), ' formLabel ')]")
+        if not anchors:
+            continue
+        raw = (anchors[0].get("href") or "").strip()
+        direct = (raw and not raw.startswith("#") and not raw.lower().startswith("javascript:")
+                  and anchors[0].get("onclick") is None)
+        for label in row.xpath(".//label"):
+            links[" ".join(label.text_content().split())] = urljoin(doc.base_url, raw) if direct else None
+    return links
+
+
+def process_delegation_http(session, doc, abonne, service_label, check_all, is_last, href):
+    """Équivalent de process_delegation() ; retourne la page atteinte à la fin."""
+    print(f"      -> {service_label}...")
+    if not href:
+        raise Exception(f"Lien du service '{service_label}' en JavaScript, non gere en mode HTTP")
+
+    page = http_page(session.get(href, headers={"Referer": doc.base_url}, timeout=PAGE_TIMEOUT))
+    valider = http_find(page, "//input[@value='Valider']")
+    form = http_find(valider, "ancestor::form[1]")
+
+    overrides = []
+    roles = form.xpath(".//input[@type='radio'][@value='N2'][starts-with(@name,'role')]")
+    for radio in roles:
+        overrides.append((radio.get("name"), "N2"))
+    if roles:
+        print(f"        Role 'Acteur' selectionne ({len(roles)} activite(s)).")
+    if check_all:
+        for cb in form.xpath(".//input[@type='checkbox'][@name]"):
+            overrides.append((cb.get("name"), cb.get("value", "on")))
+    recap = http_submit(session, page, form, overrides, submit_value="Valider")
+
+    if is_last:
+        return http_follow(session, recap, "SaisieSirenDelegation.do")
+    page = http_follow(session, recap, "GererDelegation.do")
+    return http_enter_abonne(session, page, abonne)
+
+
+def http_session_alive(session):
+    """
+    Vérifie, après une erreur, que la session donne toujours accès à la page de
+    saisie SIREN : une session expirée redirige vers la connexion, sans champ
+    #saisieSiren. Équivalent de recover_siren_page() ; retourne False si la session est perdue.
+    """
+    try:
+        doc = http_page(session.get(DELEGATION_URL, timeout=PAGE_TIMEOUT))
+        http_find(doc, "//input[@id='saisieSiren']")
+        return True
+    except Exception:
+        return False
+
+
+def process_siren_http(session, siren, abonne):
+    """Équivalent de process_siren() par requêtes HTTP directes."""
+    print(f"   SIREN {siren}")
+
+    doc = http_page(session.get(DELEGATION_URL, timeout=PAGE_TIMEOUT))
+    field = http_find(doc, "//input[@id='saisieSiren']")
+    doc = http_submit(session, doc, field, [(field.get("name"), siren)])
+    doc = http_enter_abonne(session, doc, abonne)
+
+    href_map = http_service_links(doc)
+    available = [(label, check_all) for label, check_all in SERVICES_TUP if label in href_map]
+    if not available:
+        print(f"   Aucun service disponible pour SIREN {siren}, passage au suivant.")
+        return
+
+    print(f"   {len(available)}/{len(SERVICES)} services disponibles")
+    for i, (label, check_all) in enumerate(available):
+        is_last = (i == len(available) - 1)
+        if i > 0:
+            href_map = http_service_links(doc)
+        doc = process_delegation_http(session, doc, abonne, label, check_all, is_last, href_map.get(label))
+
+    print(f"   SIREN {siren} termine.")
+
+
+# ─── Traitement d'un onglet ───────────────────────────────────────────────────
+
+def process_sheet(client, sheet_name, sheet_data, pending):
+    """
+    Traite les SIRENs d'un onglet dont les positions sont dans `pending`, avec
+    le navigateur connecté (ou, en HTTP_MODE, la session requests créée à
+    partir de ses cookies). Retourne False si la navigation n'a pas pu être reprise.
+    """
+    abonne = sheet_data["abonne"]
+    sirens = sheet_data["sirens"]
+    rows = sheet_data["rows"]
+    done = len(rows) - len(pending)
+    with ProgressLog(sheet_name, sheet_data["read_rows"]) as progress:
+        for i in pending:
+            siren, row = sirens[i], rows[i]
+
+            for attempt in range(SIREN_ATTEMPTS):
+                try:
+                    if HTTP_MODE:
+                        process_siren_http(client, siren, abonne)
+                    else:
+                        process_siren(client, siren, abonne)
+                    break
+                except Exception as e:
+                    progress.flush()
+                    error_msg = str(e).split('\n')[0]  # première ligne seulement
+                    print(f"   Erreur sur SIREN {siren} (ligne {row}, tentative "
+                          f"{attempt + 1}/{SIREN_ATTEMPTS}): {error_msg}")
+                    last_attempt = attempt == SIREN_ATTEMPTS - 1
+                    if last_attempt:
+                        log_siren_error(sheet_name, siren, row, error_msg)
+                        print("   Skip automatique, passage au SIREN suivant.")
+                    # Tenter de revenir sur la page SIREN pour continuer
+                    # (en HTTP_MODE, chaque SIREN en repart : il suffit que la session soit valide)
+                    recovered = http_session_alive(client) if HTTP_MODE else recover_siren_page(client)
+                    if not recovered:
+                        # SIREN non noté comme traité : il sera repris à la prochaine exécution
+                        print("   ERREUR FATALE: impossible de reprendre la navigation.")
+                        print(f"   Progression sauvegardee ({done} SIRENs traites).")
+                        return False
+                    if not last_attempt:
+                        # Attente exponentielle : 1 s, 2 s, 4 s...
+                        pause(2 ** attempt)
+
+            progress.mark_done(row)
+            done += 1
+            print(f"   Progression: {done}/{len(sirens)} "
+                  f"({done / len(sirens) * 100:.1f}%)")
+    return True
+
+
+def plan_pending(sheet_name, sheet_data):
+    """
+    Retourne les positions des SIRENs restant à traiter pour un onglet, en
+    proposant de reprendre une progression existante.
+    """
+    rows = sheet_data["rows"]
+    done = load_progress(sheet_name, sheet_data["read_rows"])
+    pending = [i for i, row in enumerate(rows) if row not in done]
+    if len(pending) < len(rows):
+        print(f"\n  Reprise detectee pour '{sheet_name}' ({len(rows) - len(pending)} SIRENs deja traites)")
+        confirm = input("  Reprendre ? (o/n) : ").strip().lower()
+        if confirm != "o":
+            clear_progress(sheet_name)
+            pending = list(range(len(rows)))
+    return pending
+
+
 # ─── Main ─────────────────────────────────────────────────────────────────────
 
 def select_sheets(data):
@@ -437,10 +1199,11 @@ def select_sheets(data):
     sheets = list(data.keys())
     print("\n  Onglets disponibles :")
     for idx, name in enumerate(sheets, 1):
-        nb = len(data[name]["sirens"])
-        progress = load_progress(name)
-        resume_idx = progress.get("siren_index", 0)
-        status = f" (reprise index {resume_idx})" if resume_idx > 0 else ""
+        rows = data[name]["rows"]
+        nb = len(rows)
+        done_rows = load_progress(name, data[name]["read_rows"])
+        done = sum(row in done_rows for row in rows)
+        status = f" (reprise, {done} deja traites)" if done > 0 else ""
         print(f"    {idx}. {name} - {nb} SIRENs{status}")
     print(f"    0. Tous les onglets")
 
@@ -477,12 +1240,13 @@ def main():
     if not selected_sheets:
         return
 
-    # Initialiser le navigateur
-    driver = init_driver()
-
+    driver = None
     try:
-        # Connexion manuelle
-        login(driver)
+        # Connexion : session sauvegardée, sinon connexion manuelle
+        driver = open_session()
+
+        # En HTTP_MODE, le navigateur ne sert plus qu'à la connexion
+        client = http_session_from_driver(driver) if HTTP_MODE else driver
 
         # Boucle sur les onglets sélectionnés
         for sheet_name in selected_sheets:
@@ -490,47 +1254,18 @@ def main():
             abonne = sheet_data["abonne"]
             sirens = sheet_data["sirens"]
 
-            # Charger la progression pour cet onglet
-            progress = load_progress(sheet_name)
-            start_index = progress.get("siren_index", 0)
+            log_rejected_sirens(sheet_name, sheet_data["rejected"])
 
-            if start_index > 0:
-                print(f"\n  Reprise detectee pour '{sheet_name}' a l'index {start_index}")
-                confirm = input("  Reprendre ? (o/n) : ").strip().lower()
-                if confirm != "o":
-                    clear_progress(sheet_name)
-                    start_index = 0
+            # Charger la progression pour cet onglet
+            pending = plan_pending(sheet_name, sheet_data)
 
             print(f"\n{'='*60}")
             print(f"  Onglet: {sheet_name} | Abonne: {abonne}")
-            print(f"  SIRENs: {len(sirens)} (debut a l'index {start_index})")
+            print(f"  SIRENs: {len(sirens)} ({len(pending)} a traiter)")
             print(f"{'='*60}")
 
-            for i in range(start_index, len(sirens)):
-                siren = sirens[i]
-                save_progress(sheet_name, i)
-
-                try:
-                    process_siren(driver, siren, abonne)
-                except Exception as e:
-                    error_msg = str(e).split('\n')[0]  # première ligne seulement
-                    print(f"   Erreur sur SIREN {siren} (index {i}): {error_msg}")
-                    log_siren_error(sheet_name, siren, i, error_msg)
-                    print("   Skip automatique, passage au SIREN suivant.")
-                    # Tenter de revenir sur la page SIREN pour continuer
-                    try:
-                        navigate_to_siren_page(driver)
-                    except Exception:
-                        print("   Impossible de revenir a la page SIREN, re-navigation...")
-                        try:
-                            navigate_to_delegation_page(driver)
-                        except Exception:
-                            print("   ERREUR FATALE: impossible de reprendre la navigation.")
-                            print(f"   Progression sauvegardee a l'index {i}.")
-                            return
-
-                print(f"   Progression: {i + 1}/{len(sirens)} "
-                      f"({(i + 1) / len(sirens) * 100:.1f}%)")
+            if not process_sheet(client, sheet_name, sheet_data, pending):
+                return
 
             clear_progress(sheet_name)
             print(f"\n  Onglet '{sheet_name}' termine !")
@@ -545,9 +1280,10 @@ def main():
         print(f"\n  Erreur fatale: {e}")
         print("  Progression sauvegardee.")
     finally:
-        input("\nAppuyez sur Entree pour fermer le navigateur...")
-        driver.quit()
+        if driver is not None:
+            input("\nAppuyez sur Entree pour fermer le navigateur...")
+            driver.quit()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()